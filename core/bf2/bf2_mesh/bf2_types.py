@@ -47,17 +47,30 @@ class D3DDECLTYPE(enum.IntEnum):
     UNUSED = 17  # When the type field in a decl is unused.
 
     def get_struct_fmt(self):
-        _TYPE_TO_FORMAT = {
-            D3DDECLTYPE.FLOAT1: '1f',
-            D3DDECLTYPE.FLOAT2: '2f',
-            D3DDECLTYPE.FLOAT3: '3f',
-            D3DDECLTYPE.FLOAT4: '4f',
-            D3DDECLTYPE.D3DCOLOR: '4B',
-            D3DDECLTYPE.UNUSED: '', # will evaluate to 0 using calcsize
-        }
-
         return _TYPE_TO_FORMAT[self]
 
+    def get_value_count(self):
+        return _TYPE_TO_VALUE_COUNT[self]
+
+
+_TYPE_TO_FORMAT = {
+    D3DDECLTYPE.FLOAT1: '1f',
+    D3DDECLTYPE.FLOAT2: '2f',
+    D3DDECLTYPE.FLOAT3: '3f',
+    D3DDECLTYPE.FLOAT4: '4f',
+    D3DDECLTYPE.D3DCOLOR: '4B',
+    D3DDECLTYPE.UNUSED: '', # will evaluate to 0 using calcsize
+}
+
+_TYPE_TO_VALUE_COUNT = {
+    D3DDECLTYPE.FLOAT1: 1,
+    D3DDECLTYPE.FLOAT2: 2,
+    D3DDECLTYPE.FLOAT3: 3,
+    D3DDECLTYPE.FLOAT4: 4,
+    D3DDECLTYPE.D3DCOLOR: 4,
+    D3DDECLTYPE.UNUSED: 0,
+}
+
 
 # copypasta from DX SDK 'Include/d3d9types.h' enum _D3DDECLUSAGE to
 # address vert attribute usage variable
@@ -1,18 +1,26 @@
 import os
+import io
 import enum
 import struct
 import math
+from array import array
+from itertools import chain
 from typing import List, Optional, Tuple
 
 from .bf2_types import D3DDECLTYPE, D3DDECLUSAGE, D3DPRIMITIVETYPE, USED, UNUSED
 from ..fileutils import FileUtils
-from ..bf2_common import Vec3, Mat4, load_n_elems, calc_bounds
+from ..bf2_common import Vec3, load_n_elems
 
 class BF2MeshException(Exception):
     pass
 
 
 class Vertex:
+    __slots__ = ('position', 'blendweight', 'blendindices', 'normal', 'psize',
+                 'texcoord0', 'texcoord1', 'texcoord2', 'texcoord3', 'texcoord4',
+                 'tangent', 'binormal', 'tessfactor', 'positiont', 'color',
+                 'fog', 'depth', 'sample')
+
     def __init__(self):
         self.position = None
         self.blendweight = None
@@ -34,6 +42,66 @@ class Vertex:
         self.sample = None
 
 
+def _get_vertex_struct(vertex_decl_size, vertex_attributes):
+    # single Struct for the whole vertex declaration and (attribute name, slice) pairs
+    # mapping the unpacked values to vertex attributes
+    fmt = '<'
+    pos = 0
+    value_idx = 0
+    attr_slices = list()
+    used_attrs = [a for a in vertex_attributes if a._flag != UNUSED]
+    for vertex_attr in sorted(used_attrs, key=lambda a: a._offset):
+        attr_fmt = vertex_attr.get_struct_fmt()
+        # a single Struct cannot describe attributes sharing the same bytes
+        if vertex_attr._offset < pos:
+            raise BF2MeshException(f"Vertex attribute '{vertex_attr.decl_usage.name}' overlaps with previous one")
+        if vertex_attr._offset > pos:
+            fmt += f'{vertex_attr._offset - pos}x'
+        fmt += attr_fmt
+        pos = vertex_attr._offset + struct.calcsize(attr_fmt)
+        value_count = vertex_attr.get_value_count()
+        attr_slices.append((vertex_attr.decl_usage.name.lower(), slice(value_idx, value_idx + value_count)))
+        value_idx += value_count
+    if pos > vertex_decl_size:
+        raise BF2MeshException(f"Vertex attributes exceed vertex declaration size ({pos} > {vertex_decl_size})")
+    if pos < vertex_decl_size:
+        fmt += f'{vertex_decl_size - pos}x'
+    return struct.Struct(fmt), attr_slices
+
+
+_VERTEX_DECODERS = dict()
+
+def _get_vertex_decoder(vertex_struct, attr_slices):
+    # generate a function decoding vertices of the given layout with attribute
+    # assignments unrolled, cached per layout as meshes usually share a few of them
+    key = (vertex_struct.format, tuple((n, s.start, s.stop) for n, s in attr_slices))
+    if key in _VERTEX_DECODERS:
+        return _VERTEX_DECODERS[key]
+
+    src = 'def decode_vertices(vertex_buffer):\n'
+    src += '    vertices = list()\n'
+    src += '    for data in iter_unpack(vertex_buffer):\n'
+    src += '        vertex = Vertex()\n'
+    for attr_name, attr_slice in attr_slices:
+        src += f'        vertex.{attr_name} = data[{attr_slice.start}:{attr_slice.stop}]\n'
+    src += '        vertices.append(vertex)\n'
+    src += '    return vertices\n'
+
+    namespace = {'Vertex': Vertex, 'iter_unpack': vertex_struct.iter_unpack}
+    exec(src, namespace)
+    _VERTEX_DECODERS[key] = namespace['decode_vertices']
+    return _VERTEX_DECODERS[key]
+
+
+def _get_faces(index_buffer, istart, inum):
+    if inum % 3 != 0:
+        raise BF2MeshException(f"Material index count {inum} is not a multiple of 3")
+    if istart + inum > len(index_buffer):
+        raise BF2MeshException("Material indices exceed index buffer size")
+    indices = index_buffer[istart:istart + inum]
+    return list(zip(indices[0::3], indices[1::3], indices[2::3]))
+
+
 class Material:
 
     def __init__(self):
@@ -91,57 +159,48 @@ class Material:
         f.write_dword(0) # wite zeros and hope it doesn't break anything
         f.write_dword(0)
 
-    def load_vertices(self, vertex_decl_size, vertex_attributes, vertex_buffer):
-        self.vertices = list()
-        for i in range(self._vstart, self._vstart + self._vnum):
-            vertex = Vertex()
-            self.vertices.append(vertex)
-            for vertex_attr in vertex_attributes:
-                if vertex_attr._flag == UNUSED:
-                    continue
-                fmt = vertex_attr.decl_type.get_struct_fmt()
-                size = struct.calcsize(fmt)
-                vstart = i * vertex_decl_size + vertex_attr._offset
-                data_packed = vertex_buffer[vstart:vstart+size]
-                vertex_attr_value = struct.unpack(fmt, data_packed)
-                setattr(vertex, vertex_attr.decl_usage.name.lower(), vertex_attr_value)
-
-    def save_vertices(self, vertex_attributes, vertex_buffer, vstart):
+    def load_vertices(self, vertex_struct, attr_slices, vertex_buffer):
+        vstart = self._vstart * vertex_struct.size
+        vend = vstart + self._vnum * vertex_struct.size
+        if vend > len(vertex_buffer):
+            raise BF2MeshException("Material vertices exceed vertex buffer size")
+        decode_vertices = _get_vertex_decoder(vertex_struct, attr_slices)
+        self.vertices = decode_vertices(memoryview(vertex_buffer)[vstart:vend])
+
+    def save_vertices(self, vertex_struct, attr_slices, vertex_buffer, vstart):
+        attr_names = [attr_name for attr_name, _ in attr_slices]
         self._vstart = vstart
         self._vnum = len(self.vertices)
+
+        # vertex_buffer is expected to be preallocated for all materials
+        offset = vstart * vertex_struct.size
         for vertex in self.vertices:
-            for vertex_attr in vertex_attributes:
-                if vertex_attr._flag == UNUSED:
-                    continue
-                fmt = vertex_attr.decl_type.get_struct_fmt()
-                vertex_attr_value = getattr(vertex, vertex_attr.decl_usage.name.lower())
+            values = list()
+            for attr_name in attr_names:
+                vertex_attr_value = getattr(vertex, attr_name)
                 if vertex_attr_value is None:
-                    raise BF2MeshException(f"Vertex missing '{vertex_attr.decl_usage.name}' attribute value")
-                vertex_buffer += struct.pack(fmt, *vertex_attr_value)
+                    raise BF2MeshException(f"Vertex missing '{attr_name.upper()}' attribute value")
+                values.extend(vertex_attr_value)
+            vertex_struct.pack_into(vertex_buffer, offset, *values)
+            offset += vertex_struct.size
         return self._vnum
 
     def load_faces(self, index_buffer):
-        self.faces = list()
-        for i in range(self._istart, self._istart + self._inum, 3):
-            v1 = index_buffer[i + 0]
-            v2 = index_buffer[i + 1]
-            v3 = index_buffer[i + 2]
-            self.faces.append((v1, v2, v3))
+        self.faces = _get_faces(index_buffer, self._istart, self._inum)
 
     def save_faces(self, index_buffer, istart):
         self._inum = len(self.faces) * 3
         self._istart = istart
-        for face in self.faces:
-            index_buffer.append(face[0])
-            index_buffer.append(face[1])
-            index_buffer.append(face[2])
+        index_buffer.extend(chain.from_iterable(self.faces))
         return self._inum
 
     def calc_bounds(self):
         if not self.vertices:
             raise ValueError("Cannot calculate bounds vertices is empty")
-        verts = [vertex.position for vertex in self.vertices]
-        self._min, self._max = calc_bounds(verts)
+        # transpose to per-axis sequences so min/max run in C
+        xs, ys, zs = zip(*[vertex.position for vertex in self.vertices])
+        self._min = Vec3(min(xs), min(ys), min(zs))
+        self._max = Vec3(max(xs), max(ys), max(zs))
         return (self._min, self._max)
 
 class Plane:
@@ -149,9 +208,18 @@ class Plane:
         self.point = point
         self.normal = normal
 
+def _get_sorting_plane_normals(planes_count):
+    # plane normals are (0, 0, -1) rotated around Y axis, evenly spread on the full circle
+    normals = list()
+    for i in range(planes_count):
+        plane_rotation = -math.radians(360.0 / (2 * planes_count) + i * (360.0 / planes_count))
+        normals.append((math.sin(plane_rotation), 0, -math.cos(plane_rotation)))
+    return tuple(normals)
+
 class MaterialWithTransparency(Material):
 
     ALPHA_BLEND_FACE_SET_COUNT = 8 # same as 3Ds max exporter
+    _SORTING_PLANE_NORMALS = _get_sorting_plane_normals(ALPHA_BLEND_FACE_SET_COUNT)
 
     class AlphaMode(enum.IntEnum):
         NONE = 0
@@ -179,14 +247,8 @@ class MaterialWithTransparency(Material):
         if self.alpha_mode == self.AlphaMode.ALPHA_BLEND:
             self.face_sets = list()
             for i in range(self._alpha_blend_indexnum):
-                face_set = list()
-                self.face_sets.append(face_set)
                 istart = self._istart + i * self._inum
-                for i in range(istart, istart + self._inum, 3):
-                    v1 = index_buffer[i + 0]
-                    v2 = index_buffer[i + 1]
-                    v3 = index_buffer[i + 2]
-                    face_set.append((v1, v2, v3))
+                self.face_sets.append(_get_faces(index_buffer, istart, self._inum))
             self.faces = self.face_sets[0]
         else:
             super().load_faces(index_buffer)
@@ -202,18 +264,14 @@ class MaterialWithTransparency(Material):
         super().save(f)
 
     def _get_sorting_planes(self):
-        planes_count = self.ALPHA_BLEND_FACE_SET_COUNT
         self.calc_bounds()
         max_dist = Vec3.distance(Vec3(), self._max)
         min_dist = Vec3.distance(Vec3(), self._min)
         max_radius = max(max_dist, min_dist)
 
         sorting_planes = list()
-        for i in range(planes_count):
-            plane_rotation = 360.0 / (2 * planes_count) + i * (360.0 / planes_count)
-            rot_m = Mat4.rotation(-math.radians(plane_rotation), 'Y')
-            plane_normal = Vec3(0, 0, -1)
-            plane_normal.rotate(rot_m)
+        for normal in self._SORTING_PLANE_NORMALS:
+            plane_normal = Vec3(*normal)
             plane_point = plane_normal.copy().scale(max_radius)
             sorting_planes.append(Plane(plane_point, plane_normal))
         return sorting_planes
@@ -223,25 +281,26 @@ class MaterialWithTransparency(Material):
         self._inum = len(self.faces) * 3
         self._istart = istart
 
+        # plain tuples, no Vec3 allocations for every face
+        positions = [vertex.position for vertex in self.vertices]
+        third = 1.0 / 3
         face_mid_points = list()
-        for face in self.faces:
-            face_center = Vec3()
-            for v in face:
-                face_center.add(Vec3(*self.vertices[v].position))
-            face_center.scale(1.0 / 3)
-            face_mid_points.append(face_center)
+        for v1, v2, v3 in self.faces:
+            a, b, c = positions[v1], positions[v2], positions[v3]
+            face_mid_points.append(((a[0] + b[0] + c[0]) * third,
+                                    (a[1] + b[1] + c[1]) * third,
+                                    (a[2] + b[2] + c[2]) * third))
 
         for plane in sorting_planes:
-            face_dist_to_plane = list()
-            for face, face_center in zip(self.faces, face_mid_points):
-                delta = face_center.copy().sub(plane.point)
-                dist = abs(delta.dot_product(plane.normal))
-                face_dist_to_plane.append(dist)
-
-            for _, face in sorted(zip(face_dist_to_plane, self.faces)):
-                index_buffer.append(face[0])
-                index_buffer.append(face[1])
-                index_buffer.append(face[2])
+            # |(center - point) . normal| == |center . normal - point . normal|
+            plane_dist = plane.point.dot_product(plane.normal)
+            nx, ny, nz = plane.normal.x, plane.normal.y, plane.normal.z
+            face_dist_to_plane = [abs(cx * nx + cy * ny + cz * nz - plane_dist)
+                                  for cx, cy, cz in face_mid_points]
+
+            # sort by distance only, equally distant faces keep their original order
+            face_order = sorted(range(len(self.faces)), key=face_dist_to_plane.__getitem__)
+            index_buffer.extend(chain.from_iterable(self.faces[i] for i in face_order))
         return self._inum * len(sorting_planes)
 
 class Lod:
@@ -322,6 +381,18 @@ class VertexAttribute:
         self.decl_type : D3DDECLTYPE = decl_type
         self.decl_usage : D3DDECLUSAGE = decl_usage
 
+    def get_struct_fmt(self):
+        try:
+            return self.decl_type.get_struct_fmt()
+        except KeyError:
+            raise BF2MeshException(f"Unsupported vertex attribute type '{D3DDECLTYPE(self.decl_type).name}'") from None
+
+    def get_value_count(self):
+        try:
+            return self.decl_type.get_value_count()
+        except KeyError:
+            raise BF2MeshException(f"Unsupported vertex attribute type '{D3DDECLTYPE(self.decl_type).name}'") from None
+
     @classmethod
     def load(cls, f : FileUtils):
         _flag = f.read_word()
@@ -382,12 +453,15 @@ class BF2VisibleMesh():
         if not file:
             return
 
+        # read the whole file at once, parsing from memory is way faster than many tiny reads
         with open(file, mode='rb') as fo:
-            f = FileUtils(fo)
-            self.load(f)
+            data = fo.read()
 
-            if os.fstat(fo.fileno()).st_size != fo.tell():
-                raise BF2MeshException(f"Corrupted {self._FILE_EXT} file? Reading finished and file pointer != filesize")
+        buffer = io.BytesIO(data)
+        self.load(FileUtils(buffer))
+
+        if len(data) != buffer.tell():
+            raise BF2MeshException(f"Corrupted {self._FILE_EXT} file? Reading finished and file pointer != filesize")
 
 
     def load(self, f : FileUtils):
@@ -408,8 +482,8 @@ class BF2VisibleMesh():
 
         vertex_decl_size = f.read_dword() # byte size of Vertex declaration
 
-        vertex_buffer : bytes = f.read_raw(vertex_decl_size * f.read_dword())
-        index_buffer : List[int] = f.read_word(count=f.read_dword())
+        vertex_buffer = f.read_raw(vertex_decl_size * f.read_dword())
+        index_buffer = f.read_word_array(count=f.read_dword())
 
         alpha_blend_indexnum = None
         if issubclass(self._GEOM_TYPE._LOD_TYPE._MATERIAL_TYPE, MaterialWithTransparency):
@@ -419,76 +493,83 @@ class BF2VisibleMesh():
             for lod in geom.lods:
                 lod.load_parts_rigs(f, version=version)
 
+        vertex_struct, attr_slices = _get_vertex_struct(vertex_decl_size, self.vertex_attributes)
+
         for geom in self.geoms:
             for lod in geom.lods:
                 lod.load_materials(f, version=version, alpha_blend_indexnum=alpha_blend_indexnum)
                 for mat in lod.materials:
-                    mat.load_vertices(vertex_decl_size, self.vertex_attributes, vertex_buffer)
+                    mat.load_vertices(vertex_struct, attr_slices, vertex_buffer)
                     mat.load_faces(index_buffer)
 
     def export(self, export_path):
+        # build the whole file in memory and write it at once
+        buffer = io.BytesIO()
+        f = FileUtils(buffer)
+        MeshHeader.save(f, self._VERSION)
+        f.write_dword(len(self.geoms))
+        for geom in self.geoms:
+            geom.save(f)
+
+        f.write_dword(len(self.vertex_attributes) + 1) # +1 for unused
+
+        vertex_decl_size = 0
+        for vertex_attr in self.vertex_attributes:
+            if vertex_attr._flag == UNUSED:
+                continue
+            vertex_attr._offset = vertex_decl_size
+            vertex_attr._flag = USED
+            vertex_attr.save(f)
+            vertex_decl_size += struct.calcsize(vertex_attr.get_struct_fmt())
+
+        # add last dummy attribute that always is set to unused for _reasons_
+        unused_attr = VertexAttribute(D3DDECLTYPE.UNUSED, 0)
+        unused_attr._offset = 0
+        unused_attr._flag = UNUSED
+        unused_attr.save(f)
+
+        f.write_dword(D3DPRIMITIVETYPE.TRIANGLELIST)
+        f.write_dword(vertex_decl_size)
+
+        vertex_struct, attr_slices = _get_vertex_struct(vertex_decl_size, self.vertex_attributes)
+        vertex_count = sum(len(mat.vertices) for geom in self.geoms for lod in geom.lods for mat in lod.materials)
+        vertex_buffer = bytearray(vertex_count * vertex_decl_size)
+        index_buffer = array('H')
+
+        has_alpha_blend_material = False
+
+        vstart = 0
+        istart = 0
+        for geom in self.geoms:
+            for lod in geom.lods:
+                for mat in lod.materials:
+                    if isinstance(mat, MaterialWithTransparency):
+                        is_alpha_blend = mat.alpha_mode == MaterialWithTransparency.AlphaMode.ALPHA_BLEND
+                        has_alpha_blend_material |= is_alpha_blend
+                    vstart += mat.save_vertices(vertex_struct, attr_slices, vertex_buffer, vstart)
+                    istart += mat.save_faces(index_buffer, istart)
+
+        f.write_dword(int(len(vertex_buffer) / vertex_decl_size))
+        f.write_raw(vertex_buffer)
+        f.write_dword(len(index_buffer))
+        f.write_word_array(index_buffer)
+
+        if issubclass(self._GEOM_TYPE._LOD_TYPE._MATERIAL_TYPE, MaterialWithTransparency):
+            if has_alpha_blend_material:
+                f.write_dword(MaterialWithTransparency.ALPHA_BLEND_FACE_SET_COUNT)
+            else:
+                f.write_dword(0)
+
+        for geom in self.geoms:
+            for lod in geom.lods:
+                lod.save_parts_rigs(f)
+
+        for geom in self.geoms:
+            for lod in geom.lods:
+                lod.save_materials(f)
+
         with open(export_path, "wb") as file:
-            f = FileUtils(file)
-            MeshHeader.save(f, self._VERSION)
-            f.write_dword(len(self.geoms))
-            for geom in self.geoms:
-                geom.save(f)
-   
-            f.write_dword(len(self.vertex_attributes) + 1) # +1 for unused
-
-            vertex_decl_size = 0
-            for vertex_attr in self.vertex_attributes:
-                if vertex_attr._flag == UNUSED:
-                    continue
-                vertex_attr._offset = vertex_decl_size
-                vertex_attr._flag = USED
-                vertex_attr.save(f)
-                fmt = vertex_attr.decl_type.get_struct_fmt()
-                vertex_decl_size += struct.calcsize(fmt)
-
-            # add last dummy attribute that always is set to unused for _reasons_
-            unused_attr = VertexAttribute(D3DDECLTYPE.UNUSED, 0)
-            unused_attr._offset = 0
-            unused_attr._flag = UNUSED
-            unused_attr.save(f)
-
-            f.write_dword(D3DPRIMITIVETYPE.TRIANGLELIST)
-            f.write_dword(vertex_decl_size)
-
-            vertex_buffer : bytearray = bytearray()
-            index_buffer : List[int] = list()
-
-            has_alpha_blend_material = False
-
-            vstart = 0
-            istart = 0
-            for geom in self.geoms:
-                for lod in geom.lods:
-                    for mat in lod.materials:
-                        if isinstance(mat, MaterialWithTransparency):
-                            is_alpha_blend = mat.alpha_mode == MaterialWithTransparency.AlphaMode.ALPHA_BLEND
-                            has_alpha_blend_material |= is_alpha_blend
-                        vstart += mat.save_vertices(self.vertex_attributes, vertex_buffer, vstart)
-                        istart += mat.save_faces(index_buffer, istart)
-
-            f.write_dword(int(len(vertex_buffer) / vertex_decl_size))
-            f.write_raw(bytes(vertex_buffer))
-            f.write_dword(len(index_buffer))
-            f.write_word(index_buffer)
-
-            if issubclass(self._GEOM_TYPE._LOD_TYPE._MATERIAL_TYPE, MaterialWithTransparency):
-                if has_alpha_blend_material:
-                    f.write_dword(MaterialWithTransparency.ALPHA_BLEND_FACE_SET_COUNT)
-                else:
-                    f.write_dword(0)
-
-            for geom in self.geoms:
-                for lod in geom.lods:
-                    lod.save_parts_rigs(f)
-            
-            for geom in self.geoms:
-                for lod in geom.lods:
-                    lod.save_materials(f)
+            file.write(buffer.getbuffer())
 
     def _has_vert_attr(self, decl_usage):
         for vert_attr in self.vertex_attributes:
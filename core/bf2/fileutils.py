@@ -1,4 +1,6 @@
+import sys
 import struct
+from array import array
 
 class FileUtils:
     def __init__(self, file):
@@ -33,6 +35,13 @@ class FileUtils:
     def read_dword(self, count=1, signed=False):
         return self._read('I', count=count, signed=signed)
 
+    def read_word_array(self, count):
+        unpacked = array('H')
+        unpacked.frombytes(self.file.read(count * unpacked.itemsize))
+        if sys.byteorder == 'big':
+            unpacked.byteswap()
+        return unpacked
+
     def read_float(self, count=1):
         return self._read('f', count=count)
 
@@ -53,6 +62,12 @@ class FileUtils:
     def write_dword(self, content, signed=False):
         self._write('I', content, signed=signed)
     
+    def write_word_array(self, content):
+        if sys.byteorder == 'big':
+            content = array('H', content)
+            content.byteswap()
+        self.file.write(content)
+
     def write_float(self, content, signed=False):
         self._write('f', content, signed=signed)
 
@@ -3,24 +3,35 @@ import bmesh # type: ignore
 import traceback
 
 from bpy.props import IntProperty, BoolProperty, EnumProperty # type: ignore
+from bpy.app.handlers import persistent # type: ignore
 from ..core.anim_utils import toggle_mesh_mask_mesh_for_active_bone, setup_controllers, reparent_bones
 from ..core.mesh import AnimUv, _flip_uv
 
+# controller setup state, lives as long as the menu entries appended
+# on setup start (poll reads it on every redraw)
+_setup_state = {'is_setup': False}
+
 def _bf2_setup_started(context):
-    context.scene['bf2_is_setup'] = True
+    _setup_state['is_setup'] = True
     bpy.types.VIEW3D_MT_editor_menus.append(menu_func_view3d)
 
 
 def _bf2_is_setup(context):
-    return 'bf2_is_setup' in context.scene and context.scene['bf2_is_setup']
+    return _setup_state['is_setup']
 
 
 def _bf2_setup_finished(context):
-    if 'bf2_is_setup' in context.scene:
-        del context.scene['bf2_is_setup']
+    _setup_state['is_setup'] = False
     bpy.types.VIEW3D_MT_editor_menus.remove(menu_func_view3d)
 
 
+@persistent
+def _bf2_setup_reset(*args):
+    # setup state belongs to the previous file, drop it when another one gets loaded
+    if _setup_state['is_setup']:
+        _bf2_setup_finished(bpy.context)
+
+
 class IMPORT_OT_bf2_anim_ctrl_setup_mask(bpy.types.Operator):
     bl_idname = "bf2_animation.anim_ctrl_setup_mask"
     bl_label = "Toggle masking weapon mesh that corresponds to the active bone"
@@ -109,37 +120,46 @@ class EDIT_MESH_SELECT_OT_bf2_select_anim_uv_matrix(bpy.types.Operator):
         obj = context.view_layer.objects.active
         mesh = obj.data
 
-        bm = bmesh.from_edit_mesh(mesh)
-
-        bm.verts.ensure_lookup_table()
-        bm.verts.index_update()
-
-        layer = bm.verts.layers.int.get('animuv_matrix_index')
-
-        for vert in bm.verts:
-            if layer and vert[layer] == self.uv_matrix_index:
-                vert.select_set(True)
-            else:
-                vert.select_set(False)
+        if 'animuv_matrix_index' not in mesh.attributes:
+            # nothing can match
+            bpy.ops.mesh.select_all(action='DESELECT')
+            return {'FINISHED'}
+
+        # attribute values and vertex selection can only be accessed in bulk outside of edit mode
+        bpy.ops.object.mode_set(mode='OBJECT')
+        vert_matrix = len(mesh.vertices) * [None]
+        mesh.attributes['animuv_matrix_index'].data.foreach_get('value', vert_matrix)
+        selection = [matrix_index == self.uv_matrix_index for matrix_index in vert_matrix]
+        mesh.vertices.foreach_set('select', selection)
+        # clear previous edge/face selection, flushing below only selects them from verts
+        mesh.edges.foreach_set('select', len(mesh.edges) * [False])
+        mesh.polygons.foreach_set('select', len(mesh.polygons) * [False])
+        bpy.ops.object.mode_set(mode='EDIT')
 
+        bm = bmesh.from_edit_mesh(mesh)
         bm.select_mode |= {'VERT'}
         bm.select_flush_mode()
         bmesh.update_edit_mesh(mesh)
 
         return {'FINISHED'}
 
+_SELECT_UV_MATRIX_ENTRIES = (
+    ("Select Left Wheel Rotation", AnimUv.L_WHEEL_ROTATION),
+    ("Select Left Wheel Translation", AnimUv.L_WHEEL_TRANSLATION),
+    ("Select Right Wheel Rotation", AnimUv.R_WHEEL_ROTATION),
+    ("Select Right Wheel Translation", AnimUv.R_WHEEL_TRANSLATION),
+    ("Select Left Track Translation", AnimUv.L_TRACK_TRANSLATION),
+    ("Select Right Track Translation", AnimUv.R_TRACK_TRANSLATION),
+)
+
 class EDIT_MESH_SELECT_MT_bf2_submenu(bpy.types.Menu):
     bl_idname = "EDIT_MESH_SELECT_MT_bf2_submenu"
     bl_label = "Battlefield 2"
 
     def draw(self, context):
         op_name = EDIT_MESH_SELECT_OT_bf2_select_anim_uv_matrix.bl_idname
-        self.layout.operator(op_name, text="Select Left Wheel Rotation").uv_matrix_index = AnimUv.L_WHEEL_ROTATION
-        self.layout.operator(op_name, text="Select Left Wheel Translation").uv_matrix_index = AnimUv.L_WHEEL_TRANSLATION
-        self.layout.operator(op_name, text="Select Right Wheel Rotation").uv_matrix_index = AnimUv.R_WHEEL_ROTATION
-        self.layout.operator(op_name, text="Select Right Wheel Translation").uv_matrix_index = AnimUv.R_WHEEL_TRANSLATION
-        self.layout.operator(op_name, text="Select Left Track Translation").uv_matrix_index = AnimUv.L_TRACK_TRANSLATION
-        self.layout.operator(op_name, text="Select Right Track Translation").uv_matrix_index = AnimUv.R_TRACK_TRANSLATION
+        for text, uv_matrix_index in _SELECT_UV_MATRIX_ENTRIES:
+            self.layout.operator(op_name, text=text).uv_matrix_index = uv_matrix_index
 
 def menu_func_edit_mesh_select(self, context):
     self.layout.menu(EDIT_MESH_SELECT_MT_bf2_submenu.bl_idname, text="BF2")
@@ -186,6 +206,16 @@ class EDIT_MESH_OT_bf2_set_anim_uv_matrix(bpy.types.Operator):
         bpy.ops.mesh.attribute_set(value_int=self.uv_matrix_index)
         return {'FINISHED'}
 
+_SET_UV_MATRIX_ENTRIES = (
+    ("Clear Wheel/Track Rotation/Translation", AnimUv.NONE),
+    ("Set Left Wheel Rotation", AnimUv.L_WHEEL_ROTATION),
+    ("Set Left Wheel Translation", AnimUv.L_WHEEL_TRANSLATION),
+    ("Set Right Wheel Rotation", AnimUv.R_WHEEL_ROTATION),
+    ("Set Right Wheel Translation", AnimUv.R_WHEEL_TRANSLATION),
+    ("Set Left Track Translation", AnimUv.L_TRACK_TRANSLATION),
+    ("Set Right Track Translation", AnimUv.R_TRACK_TRANSLATION),
+)
+
 class EDIT_MESH_MT_bf2_submenu(bpy.types.Menu):
     bl_idname = "EDIT_MESH_MT_bf2_submenu"
     bl_label = "Battlefield 2"
@@ -194,13 +224,12 @@ class EDIT_MESH_MT_bf2_submenu(bpy.types.Menu):
         op_matrix = EDIT_MESH_OT_bf2_set_anim_uv_matrix.bl_idname
         op_rot_center = EDIT_MESH_OT_bf2_set_anim_uv_rotation_center.bl_idname
         self.layout.operator(op_rot_center, text="Set Animated UV Rotation Center")
-        self.layout.operator(op_matrix, text="Clear Wheel/Track Rotation/Translation").uv_matrix_index = AnimUv.NONE
-        self.layout.operator(op_matrix, text="Set Left Wheel Rotation").uv_matrix_index = AnimUv.L_WHEEL_ROTATION
-        self.layout.operator(op_matrix, text="Set Left Wheel Translation").uv_matrix_index = AnimUv.L_WHEEL_TRANSLATION
-        self.layout.operator(op_matrix, text="Set Right Wheel Rotation").uv_matrix_index = AnimUv.R_WHEEL_ROTATION
-        self.layout.operator(op_matrix, text="Set Right Wheel Translation").uv_matrix_index = AnimUv.R_WHEEL_TRANSLATION
-        self.layout.operator(op_matrix, text="Set Left Track Translation").uv_matrix_index = AnimUv.L_TRACK_TRANSLATION
-        self.layout.operator(op_matrix, text="Set Right Track Translation").uv_matrix_index = AnimUv.R_TRACK_TRANSLATION
+        for text, uv_matrix_index in _SET_UV_MATRIX_ENTRIES:
+            self.layout.operator(op_matrix, text=text).uv_matrix_index = uv_matrix_index
+
+# enum items of POSE_OT_bf2_change_parent for the current invocation only, built once
+# instead of on every redraw (also keeps the item strings referenced for Blender)
+_parent_bone_items = dict()
 
 class POSE_OT_bf2_change_parent(bpy.types.Operator):
     bl_idname = "bf2_armature.change_parent"
@@ -209,11 +238,16 @@ class POSE_OT_bf2_change_parent(bpy.types.Operator):
 
     def get_bones(self, context):
         armature = context.view_layer.objects.active.data
+        key = armature.as_pointer()
+        if key in _parent_bone_items:
+            return _parent_bone_items[key]
+        _parent_bone_items.clear()
         items = []
         for i, bone in enumerate(armature.bones):
             if bone.name.endswith('CTRL'):
                 items.append((bone.name, bone.name, "", i))
         items.append(('NONE', 'NONE', "", len(items)))
+        _parent_bone_items[key] = items
         return items
 
     parent_bone : EnumProperty(
@@ -227,12 +261,14 @@ class POSE_OT_bf2_change_parent(bpy.types.Operator):
         return context.selected_pose_bones_from_active_object
 
     def invoke(self, context, event):
+        _parent_bone_items.clear()
         return context.window_manager.invoke_props_dialog(self)
 
     def execute(self, context):
         rig = context.view_layer.objects.active
         bones = [b.name for b in context.selected_pose_bones_from_active_object]
         parent_bone = self.parent_bone
+        _parent_bone_items.clear()
         if parent_bone == 'NONE':
             parent_bone = None
         reparent_bones(rig, bones, parent_bone)
@@ -269,8 +305,11 @@ def register():
     bpy.utils.register_class(IMPORT_OT_bf2_anim_ctrl_setup_begin)
     bpy.utils.register_class(IMPORT_OT_bf2_anim_ctrl_setup_end)
     bpy.utils.register_class(IMPORT_OT_bf2_anim_ctrl_setup_mask)
+    bpy.app.handlers.load_post.append(_bf2_setup_reset)
 
 def unregister():
+    bpy.app.handlers.load_post.remove(_bf2_setup_reset)
+    _bf2_setup_reset()
     bpy.utils.unregister_class(IMPORT_OT_bf2_anim_ctrl_setup_mask)
     bpy.utils.unregister_class(IMPORT_OT_bf2_anim_ctrl_setup_end)
     bpy.utils.unregister_class(IMPORT_OT_bf2_anim_ctrl_setup_begin)